@@ -1,13 +1,13 @@
 # app.py
 import os
-import time
+import shutil
 from pathlib import Path
 from typing import List
 
 import streamlit as st
 
-from loader import build_vectorstore_from_pdfs, load_vectorstore
-from retriever import get_similarity_retriever
+from loader import build_vectorstore_from_pdfs, load_vectorstore, warm_up_vectorstore
+from retriever import get_similarity_retriever, get_flat_similarity_retriever
 from generator import (
     make_basic_rag_chain,
     make_rag_with_sources_chain,
@@ -15,8 +15,10 @@ from generator import (
 )
 from config import (
     OPENAI_API_KEY,
+    CHAT_MODEL,
     VECTOR_DB_DIR,
     RETRIEVER_K,
+    FLAT_RETRIEVER_MAX_VECTORS,
 )
 
 
@@ -54,18 +56,96 @@ st.markdown(
 
 
 # -------------------------
-# Helper: streaming display
+# Helpers: streaming + message display
 # -------------------------
-def stream_text(text: str, delay: float = 0.01):
+def stream_answer(chain, query: str, result: dict):
     """
-    Simple character streaming utility for classy typing effect.
+    Yield answer tokens from `chain.stream(query)` for `st.write_stream`.
+
+    Answer-only chains stream plain strings. The sources/citations chains
+    stream dict chunks: "answer" tokens are yielded as they arrive, every
+    other key (context, citations, ...) is collected into `result`.
     """
-    placeholder = st.empty()
-    full_text = ""
-    for ch in text:
-        full_text += ch
-        placeholder.markdown(full_text)
-        time.sleep(delay)
+    for chunk in chain.stream(query):
+        if isinstance(chunk, str):
+            yield chunk
+            continue
+        for key, value in chunk.items():
+            if key == "answer":
+                yield value
+            else:
+                result[key] = value
+
+
+def render_citations(citations) -> None:
+    for c in citations:
+        st.markdown(
+            f"- **ID**: `{c.id}` • **Source**: `{c.source}` • "
+            f"**Title**: {c.title} • **Page**: {c.page}\n\n"
+            f"  > {c.quotes}"
+        )
+
+
+def render_sources(docs) -> None:
+    for i, d in enumerate(docs, start=1):
+        m = d.metadata
+        st.markdown(
+            f"**Source {i}** — `{m.get('source')}` · "
+            f"Title: *{m.get('title')}* · Page: {m.get('page')}"
+        )
+        st.write(d.page_content[:1000] + ("..." if len(d.page_content) > 1000 else ""))
+
+
+# -------------------------
+# Cached resources (survive script reruns)
+# -------------------------
+# The API key is part of every cache key: OpenAI clients read it once at
+# construction, so a new key in the sidebar must produce fresh clients.
+def uses_flat_retriever(vectorstore) -> bool:
+    return vectorstore._collection.count() <= FLAT_RETRIEVER_MAX_VECTORS
+
+
+@st.cache_resource(show_spinner=False)
+def get_vectorstore(persist_directory: str, api_key: str):
+    vectorstore = load_vectorstore(persist_directory)
+    if api_key:
+        # Pay the first embedding round-trip once, at startup; the HNSW index
+        # is only worth loading when the flat retriever won't be used
+        warm_up_vectorstore(vectorstore, hnsw=not uses_flat_retriever(vectorstore))
+    return vectorstore
+
+
+@st.cache_resource(show_spinner=False)
+def get_flat_retriever(persist_directory: str, api_key: str):
+    # Loads every vector once; per-k retrievers below share the same matrix
+    vectorstore = get_vectorstore(persist_directory, api_key)
+    return get_flat_similarity_retriever(vectorstore)
+
+
+def get_retriever(persist_directory: str, k: int, api_key: str):
+    vectorstore = get_vectorstore(persist_directory, api_key)
+    if uses_flat_retriever(vectorstore):
+        flat_retriever = get_flat_retriever(persist_directory, api_key)
+        return flat_retriever.model_copy(update={"k": k})
+    return get_similarity_retriever(vectorstore, k=k)
+
+
+@st.cache_resource(show_spinner=False)
+def get_rag_chain(
+    persist_directory: str,
+    mode: str,
+    k: int,
+    chat_model: str,
+    api_key: str,
+):
+    retriever = get_retriever(persist_directory, k, api_key)
+
+    if mode == "Answer only":
+        return make_basic_rag_chain(retriever)
+    elif mode == "Answer + sources":
+        return make_rag_with_sources_chain(retriever)
+    else:
+        return make_rag_with_citations_chain(retriever)
 
 
 # -------------------------
@@ -112,26 +192,34 @@ if st.sidebar.button("Build / Refresh Vector Index") and uploaded_files:
     pdf_paths: List[Path] = []
     for f in uploaded_files:
         save_path = data_dir / f.name
+        # Stream in 1MB blocks instead of materializing a second copy via f.read()
+        f.seek(0)
         with open(save_path, "wb") as out:
-            out.write(f.read())
+            shutil.copyfileobj(f, out, length=1 << 20)
         pdf_paths.append(save_path)
 
     # Build vectorstore
     vectorstore = build_vectorstore_from_pdfs(pdf_paths, persist_directory=VECTOR_DB_DIR)
+    # The index changed: drop cached stores/chains so they pick it up
+    get_vectorstore.clear()
+    get_flat_retriever.clear()
+    get_rag_chain.clear()
     index_status.success(f"Vector index built with {len(pdf_paths)} file(s).")
 
 
 # -------------------------
 # Load existing vectorstore if present
 # -------------------------
-vectorstore_available = Path(VECTOR_DB_DIR).exists() and any(
-    Path(VECTOR_DB_DIR).iterdir()
-)
-
-if vectorstore_available:
-    vectorstore = load_vectorstore(VECTOR_DB_DIR)
-else:
-    vectorstore = None
+vectorstore = None
+if Path(VECTOR_DB_DIR).exists() and any(Path(VECTOR_DB_DIR).iterdir()):
+    vectorstore = get_vectorstore(VECTOR_DB_DIR, api_key)
+    # The directory can hold an older / other collection only: opening ours
+    # then yields an empty one, which must count as "no index" too
+    if vectorstore._collection.count() == 0:
+        vectorstore = None
+    elif api_key:
+        # Build the retriever + chain up front too, not on the first question
+        get_rag_chain(VECTOR_DB_DIR, mode, top_k, CHAT_MODEL, api_key)
 
 
 # -------------------------
@@ -147,27 +235,21 @@ st.caption(
     "Answers are retrieved from a context-aware vector index built with LangChain + Chroma + OpenAI."
 )
 
-# Show existing chat history
-for msg in st.session_state["messages"]:
-    with st.chat_message(msg["role"]):
-        st.markdown(msg["content"])
-        if msg.get("citations"):
-            with st.expander("Show citations"):
-                for c in msg["citations"]:
-                    st.markdown(
-                        f"- **ID**: `{c.id}` • **Source**: `{c.source}` • "
-                        f"**Title**: {c.title} • **Page**: {c.page}\n\n"
-                        f"  > {c.quotes}"
-                    )
-        if msg.get("sources"):
-            with st.expander("Show source documents"):
-                for i, d in enumerate(msg["sources"], start=1):
-                    m = d.metadata
-                    st.markdown(
-                        f"**Source {i}** — `{m.get('source')}` · "
-                        f"Title: *{m.get('title')}* · Page: {m.get('page')}"
-                    )
-                    st.write(d.page_content[:1000] + ("..." if len(d.page_content) > 1000 else ""))
+# Show existing chat history. It runs as a fragment, so opening or closing a
+# panel reruns only this block, and source/citation bodies are only built
+# while their toggle is on (closed panels create no widgets).
+@st.fragment
+def render_chat_history():
+    for n, msg in enumerate(st.session_state["messages"]):
+        with st.chat_message(msg["role"]):
+            st.markdown(msg["content"])
+            if msg.get("citations") and st.toggle("Show citations", key=f"cite_{n}"):
+                render_citations(msg["citations"])
+            if msg.get("sources") and st.toggle("Show source documents", key=f"src_{n}"):
+                render_sources(msg["sources"])
+
+
+render_chat_history()
 
 
 # -------------------------
@@ -188,31 +270,22 @@ if user_query:
         with st.chat_message("user"):
             st.markdown(user_query)
 
-        # 2. Build retriever + chain based on mode
-        retriever = get_similarity_retriever(vectorstore, k=top_k)
-
-        if mode == "Answer only":
-            chain = make_basic_rag_chain(retriever)
-        elif mode == "Answer + sources":
-            chain = make_rag_with_sources_chain(retriever)
-        else:
-            chain = make_rag_with_citations_chain(retriever)
+        # 2. Get (cached) retriever + chain based on mode
+        chain = get_rag_chain(VECTOR_DB_DIR, mode, top_k, CHAT_MODEL, api_key)
 
         # 3. Run chain
         with st.chat_message("assistant"):
+            result = {}
+            answer = st.write_stream(stream_answer(chain, user_query, result))
+
             if mode == "Answer only":
-                answer = chain.invoke(user_query)
-                stream_text(answer)
                 st.session_state["messages"].append(
                     {"role": "assistant", "content": answer}
                 )
 
             elif mode == "Answer + sources":
-                result = chain.invoke(user_query)
-                answer = result["answer"]
                 docs = result["context"]
 
-                stream_text(answer)
                 st.session_state["messages"].append(
                     {
                         "role": "assistant",
@@ -222,23 +295,14 @@ if user_query:
                 )
 
             else:  # Answer + citations
-                result = chain.invoke(user_query)
-                answer = result["answer"]
                 cited = result["citations"]  # QuotedCitations model
                 citations_list = cited.citations
 
-                stream_text(answer)
-
-                # Also show citations right away under the streaming text
+                # Also show citations right away under the streamed text
                 if citations_list:
                     st.markdown(" ")
                     st.markdown("**Citations:**")
-                    for c in citations_list:
-                        st.markdown(
-                            f"- **ID**: `{c.id}` • **Source**: `{c.source}` • "
-                            f"**Title**: {c.title} • **Page**: {c.page}\n\n"
-                            f"  > {c.quotes}"
-                        )
+                    render_citations(citations_list)
 
                 st.session_state["messages"].append(
                     {
@@ -247,3 +311,7 @@ if user_query:
                         "citations": citations_list,
                     }
                 )
+
+        # Redraw so the new turn is rendered once, by the history fragment;
+        # otherwise toggling a panel would redraw it there on top of this copy
+        st.rerun()
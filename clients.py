@@ -0,0 +1,74 @@
+# clients.py
+from __future__ import annotations
+
+import os
+from functools import lru_cache
+
+import httpx
+from langchain_core.caches import BaseCache
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+from config import (
+    CHAT_MODEL,
+    EMBEDDING_MODEL,
+    EMBEDDING_DIMENSIONS,
+    EMBEDDING_BATCH_SIZE,
+    HTTP_MAX_CONNECTIONS,
+    HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    HTTP_TIMEOUT,
+)
+
+
+# -------------------------
+# Shared HTTP client
+# -------------------------
+@lru_cache(maxsize=1)
+def get_http_client() -> httpx.Client:
+    """
+    One pooled HTTP/2 client shared by every OpenAI model in the app, so
+    connections (and their TLS sessions) are reused across chains, chunks
+    and threads instead of being re-established per client.
+    """
+    return httpx.Client(
+        http2=True,
+        limits=httpx.Limits(
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            max_connections=HTTP_MAX_CONNECTIONS,
+        ),
+        timeout=HTTP_TIMEOUT,
+    )
+
+
+# -------------------------
+# Memoized OpenAI models
+# -------------------------
+# The API key is part of the memo key: the sidebar can change
+# OPENAI_API_KEY mid-session, and clients read it once at construction.
+@lru_cache(maxsize=None)
+def _chat_llm(model: str, api_key: str | None, cache: BaseCache | None) -> ChatOpenAI:
+    return ChatOpenAI(
+        model_name=model,
+        temperature=0,
+        api_key=api_key,
+        cache=cache,
+        http_client=get_http_client(),
+    )
+
+
+@lru_cache(maxsize=None)
+def _embedding_model(api_key: str | None) -> OpenAIEmbeddings:
+    return OpenAIEmbeddings(
+        model=EMBEDDING_MODEL,
+        dimensions=EMBEDDING_DIMENSIONS,
+        chunk_size=EMBEDDING_BATCH_SIZE,
+        api_key=api_key,
+        http_client=get_http_client(),
+    )
+
+
+def get_chat_llm(model: str = CHAT_MODEL, cache: BaseCache | None = None) -> ChatOpenAI:
+    return _chat_llm(model, os.environ.get("OPENAI_API_KEY"), cache)
+
+
+def get_embedding_model() -> OpenAIEmbeddings:
+    return _embedding_model(os.environ.get("OPENAI_API_KEY"))
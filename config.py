@@ -15,14 +15,51 @@ if not OPENAI_API_KEY:
 
 # ---- Models ----
 EMBEDDING_MODEL = "text-embedding-3-small"
+# text-embedding-3 vectors can be truncated server-side (1536 -> 512 dims is
+# ~3x less index memory/disk). Changing this requires rebuilding the index.
+EMBEDDING_DIMENSIONS = 512
 CHAT_MODEL = "gpt-4o-mini"
+# Texts per embeddings request. Chunks are ~1k tokens, and OpenAI caps a
+# single request at 300k input tokens, so stay well under that.
+EMBEDDING_BATCH_SIZE = 256
+
+# ---- OpenAI HTTP client (shared by all chat / embedding models) ----
+HTTP_MAX_CONNECTIONS = 64
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 32
+HTTP_TIMEOUT = 60.0
 
 # ---- Vector store path ----
 VECTOR_DB_DIR = "./my_context_db"
+# The embedding size is part of the collection name: a collection's vector
+# dimension is fixed at creation, so changing EMBEDDING_DIMENSIONS starts a
+# fresh collection instead of failing against an old one.
+COLLECTION_NAME = f"my_context_db_{EMBEDDING_DIMENSIONS}"
+# On-disk caches for chunk contexts + embeddings (kept outside the Chroma
+# dir so deleting the index doesn't throw away paid-for LLM/embedding calls)
+CACHE_DIR = "./.rag_cache"
+# Records per Chroma insert (Chroma rejects batches above its max batch size)
+CHROMA_BATCH_SIZE = 5000
 
 # ---- Chunking params ----
 CHUNK_SIZE = 3500
 CHUNK_OVERLAP = 0
 
 # ---- Retriever defaults ----
-RETRIEVER_K = 5
\ No newline at end of file
+RETRIEVER_K = 5
+# Collections up to this many chunks are searched with an exact in-memory
+# scan (FlatSimilarityRetriever) instead of Chroma's HNSW index
+FLAT_RETRIEVER_MAX_VECTORS = 100_000
+
+# ---- Contextualization params ----
+# Documents longer than this (in characters) are summarized section by section
+# before contextualization, instead of pasting the full text into every call
+CONTEXT_DOC_MAX_CHARS = 40_000
+# Max concurrent chunk-context LLM calls per document
+CONTEXT_MAX_CONCURRENCY = 16
+# Max PDFs contextualized in parallel during indexing
+INGEST_MAX_WORKERS = 8
+# Uploads smaller than this (total PDF bytes) are text-extracted inline; above
+# it, extraction moves to a process pool
+EXTRACT_PROCESS_MIN_BYTES = 20 * 1024 * 1024
+# Attempts per chunk on rate-limit / connection errors (exponential backoff)
+CONTEXT_MAX_RETRIES = 5
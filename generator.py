@@ -1,7 +1,7 @@
 # generator.py
 from __future__ import annotations
 
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator
 
 from operator import itemgetter
 
@@ -13,10 +13,12 @@ from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables import (
     RunnablePassthrough,
     RunnableLambda,
+    RunnableGenerator,
 )
+from langchain_core.runnables.utils import AddableDict
 from langchain_openai import ChatOpenAI
 
-from config import CHAT_MODEL
+from clients import get_chat_llm
 
 
 # -------------------------
@@ -55,6 +57,25 @@ class QuotedCitations(BaseModel):
     )
 
 
+class AnswerWithCitations(BaseModel):
+    """
+    Answer the question using only the given context articles, and quote
+    citations from those articles that justify the answer.
+    """
+
+    answer: str = Field(
+        description=(
+            "The detailed, well formatted answer to the question. "
+            "If the answer is not in the context articles, say that you don't know."
+        )
+    )
+    citations: List[Citation] = Field(
+        description=(
+            "Citations (can be multiple) from the context articles that justify the answer."
+        )
+    )
+
+
 # -------------------------
 # Shared prompts
 # -------------------------
@@ -72,53 +93,57 @@ Context:
 Answer:
 """
 
-CITATIONS_PROMPT = """You are an assistant who is an expert in analyzing answers to questions
-and finding referenced citations from context articles.
-
-Given the question, the context articles, and the generated answer,
-analyze the answer and quote citations from the context articles
-that justify the answer.
+RAG_WITH_CITATIONS_PROMPT = """You are an assistant who is an expert in question-answering tasks
+and in finding referenced citations from context articles.
+Answer the following question using only the context articles.
+If the answer is not in the context, say that you don't know.
+Keep the answer detailed and well formatted.
+Then quote citations from the context articles that justify the answer.
 
 Question:
 {question}
 
 Context Articles:
 {context}
-
-Answer:
-{answer}
 """
 
 rag_prompt_template = ChatPromptTemplate.from_template(RAG_PROMPT)
-cite_prompt_template = ChatPromptTemplate.from_template(CITATIONS_PROMPT)
+rag_cite_prompt_template = ChatPromptTemplate.from_template(RAG_WITH_CITATIONS_PROMPT)
 
 
 def _get_chat_llm() -> ChatOpenAI:
-    return ChatOpenAI(model_name=CHAT_MODEL, temperature=0)
+    return get_chat_llm()
 
 
 def format_docs(docs: List[Document]) -> str:
     return "\n\n".join(doc.page_content for doc in docs)
 
 
-def format_docs_with_metadata(docs: List[Document]) -> str:
+def format_doc_header(metadata: Dict[str, Any]) -> str:
     """
-    prepend metadata so the citing LLM can reference IDs.
+    metadata header that precedes a document's content for the citing LLM.
     """
-    formatted_docs = []
-    for doc in docs:
-        m = doc.metadata
-        formatted_docs.append(
-            f"""Context Article ID: {m.get('id')}
-Context Article Source: {m.get('source')}
-Context Article Title: {m.get('title')}
-Context Article Page: {m.get('page')}
+    return f"""Context Article ID: {metadata.get('id')}
+Context Article Source: {metadata.get('source')}
+Context Article Title: {metadata.get('title')}
+Context Article Page: {metadata.get('page')}
 
 Content:
-{doc.page_content}
 """
-        )
-    return "\n\n---\n\n".join(formatted_docs)
+
+
+def format_docs_with_metadata(docs: List[Document]) -> str:
+    """
+    prepend metadata so the citing LLM can reference IDs.
+    The header is precomputed at ingestion (metadata["_formatted"]); it is
+    only rebuilt for documents indexed before that existed.
+    """
+    return "\n\n---\n\n".join(
+        (doc.metadata.get("_formatted") or format_doc_header(doc.metadata))
+        + doc.page_content
+        + "\n"
+        for doc in docs
+    )
 
 
 # -------------------------
@@ -167,34 +192,49 @@ def make_rag_with_sources_chain(retriever) -> RunnablePassthrough:
 # -------------------------
 # RAG with citations (answer + structured citations)
 # -------------------------
+def _split_answer_and_citations(chunks: Iterator[Dict[str, Any]]) -> Iterator[AddableDict]:
+    """
+    Re-shape the single structured-output call into the usual output keys.
+    Partial AnswerWithCitations snapshots become "answer" token deltas, so the
+    answer still streams; the parsed citations are emitted once complete.
+    """
+    answer_so_far = ""
+    response: Dict[str, Any] = {}
+    for chunk in chunks:
+        for key, value in chunk.items():
+            if key != "answer_with_citations":
+                yield AddableDict({key: value})
+                continue
+
+            response = value or {}
+            answer = response.get("answer") or ""
+            if len(answer) > len(answer_so_far):
+                yield AddableDict({"answer": answer[len(answer_so_far):]})
+                answer_so_far = answer
+
+    parsed = AnswerWithCitations.model_validate(response)
+    yield AddableDict({"citations": QuotedCitations(citations=parsed.citations)})
+
+
 def make_rag_with_citations_chain(retriever) -> RunnablePassthrough:
     llm = _get_chat_llm()
-    structured_llm = llm.with_structured_output(QuotedCitations)
+    # JSON-schema (not the pydantic class) so partial results stream through
+    structured_llm = llm.with_structured_output(AnswerWithCitations.model_json_schema())
 
-    rag_response_chain = (
+    # One LLM call produces both the answer and its citations
+    answer_with_citations_chain = (
         {
             "context": itemgetter("context") | RunnableLambda(format_docs_with_metadata),
             "question": itemgetter("question"),
         }
-        | rag_prompt_template
-        | llm
-        | StrOutputParser()
-    )
-
-    cite_response_chain = (
-        {
-            "context": itemgetter("context") | RunnableLambda(format_docs_with_metadata),
-            "question": itemgetter("question"),
-            "answer": itemgetter("answer"),
-        }
-        | cite_prompt_template
+        | rag_cite_prompt_template
         | structured_llm
     )
 
     rag_chain_w_citations = (
         {"context": retriever, "question": RunnablePassthrough()}
-        | RunnablePassthrough.assign(answer=rag_response_chain)
-        | RunnablePassthrough.assign(citations=cite_response_chain)
+        | RunnablePassthrough.assign(answer_with_citations=answer_with_citations_chain)
+        | RunnableGenerator(_split_answer_and_citations)
     )
 
     # Output shape:
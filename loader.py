@@ -1,27 +1,48 @@
 # loader.py
 from __future__ import annotations
 
+import hashlib
+import multiprocessing
 import os
-import uuid
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Tuple
+
+import fitz  # PyMuPDF
+from tqdm import tqdm
 
-from langchain.document_loaders import PyMuPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.docstore.document import Document
 
 from langchain_openai import OpenAIEmbeddings, ChatOpenAI
 from langchain_chroma import Chroma
+from chromadb.config import Settings
 from langchain.prompts import ChatPromptTemplate
 from langchain.schema import StrOutputParser
-
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.storage import LocalFileStore
+from langchain_community.cache import SQLiteCache
+from langchain_core.runnables import Runnable
+from openai import APIConnectionError, RateLimitError
+
+from clients import get_chat_llm, get_embedding_model
+from generator import format_doc_header
 from config import (
     OPENAI_API_KEY,
     EMBEDDING_MODEL,
-    CHAT_MODEL,
+    EMBEDDING_DIMENSIONS,
     VECTOR_DB_DIR,
+    COLLECTION_NAME,
+    CACHE_DIR,
     CHUNK_SIZE,
     CHUNK_OVERLAP,
+    CONTEXT_DOC_MAX_CHARS,
+    CONTEXT_MAX_CONCURRENCY,
+    CONTEXT_MAX_RETRIES,
+    CHROMA_BATCH_SIZE,
+    INGEST_MAX_WORKERS,
+    EXTRACT_PROCESS_MIN_BYTES,
 )
 
 # Ensure key is on env for langchain_openai
@@ -32,97 +53,260 @@ if OPENAI_API_KEY:
 # -------------------------
 # LLM-based contextualizer
 # -------------------------
+_context_cache: SQLiteCache | None = None
+_context_cache_lock = threading.Lock()
+
+
+def _get_context_cache() -> SQLiteCache:
+    # First use happens inside the ingestion worker threads; SQLiteCache runs
+    # CREATE TABLE on construction, so two threads racing it would fail.
+    global _context_cache
+    with _context_cache_lock:
+        if _context_cache is None:
+            Path(CACHE_DIR).mkdir(parents=True, exist_ok=True)
+            _context_cache = SQLiteCache(
+                database_path=str(Path(CACHE_DIR) / "context_cache.sqlite")
+            )
+        return _context_cache
+
+
 def _get_context_llm() -> ChatOpenAI:
-    return ChatOpenAI(model_name=CHAT_MODEL, temperature=0)
+    # A chunk's context is a pure function of (document, chunk, model), and the
+    # cache key is the full prompt + model params, so re-indexing an unchanged
+    # PDF is served from disk instead of the API.
+    return get_chat_llm(cache=_get_context_cache())
+
+
+# The long {paper} block lives in the system message so every chunk call for
+# a document shares a byte-identical prompt prefix, which OpenAI's automatic
+# prompt caching can reuse on calls 2..N. Only the short human turn varies.
+CHUNK_CONTEXT_SYSTEM_PROMPT = """
+You are an AI assistant specializing in research/document analysis.
+Your task is to provide brief, relevant context for a chunk of text
+based on the full document.
+
+Here is the full document (or, for long documents, a section-by-section
+summary of it):
+<paper>
+{paper}
+</paper>
+"""
+
+CHUNK_CONTEXT_HUMAN_PROMPT = """
+Here is the chunk:
+<chunk>
+{chunk}
+</chunk>
+
+In 2–3 sentences, explain:
+- Where this chunk fits conceptually in the document (e.g., intro, methods, results, summary)
+- The main topic or idea of this chunk
+- How it relates to the overall document
+
+Keep it concise, helpful, and neutral in tone.
+
+Context:
+"""
+
+chunk_context_prompt_template = ChatPromptTemplate.from_messages(
+    [
+        ("system", CHUNK_CONTEXT_SYSTEM_PROMPT),
+        ("human", CHUNK_CONTEXT_HUMAN_PROMPT),
+    ]
+)
 
 
-def generate_chunk_context(document: str, chunk: str) -> str:
+DOC_SUMMARY_PROMPT = """
+You are an AI assistant specializing in research/document analysis.
+Summarize the following section of a larger document so that individual
+passages from it can later be placed in context.
+
+Keep the section's structure (e.g., intro, methods, results, summary),
+its main topics and ideas, and any key terms, names and numbers.
+
+<section>
+{section}
+</section>
+
+Summary:
+"""
+
+doc_summary_prompt_template = ChatPromptTemplate.from_template(DOC_SUMMARY_PROMPT)
+
+
+def _build_llm_chain(prompt_template: ChatPromptTemplate) -> Runnable:
     """
-    Given the full paper/document + a chunk, generate a short context string
-    describing how this chunk fits into the overall doc.
+    prompt | llm | parser, retried with exponential backoff on rate limits
+    and transient connection errors.
     """
-    chunk_process_prompt = """
-    You are an AI assistant specializing in research/document analysis.
-    Your task is to provide brief, relevant context for a chunk of text
-    based on the full document.
-
-    Here is the full document:
-    <paper>
-    {paper}
-    </paper>
+    llm = _get_context_llm()
+    chain = prompt_template | llm | StrOutputParser()
+    return chain.with_retry(
+        retry_if_exception_type=(RateLimitError, APIConnectionError),
+        wait_exponential_jitter=True,
+        stop_after_attempt=CONTEXT_MAX_RETRIES,
+    )
 
-    Here is the chunk:
-    <chunk>
-    {chunk}
-    </chunk>
 
-    In 2–3 sentences, explain:
-    - Where this chunk fits conceptually in the document (e.g., intro, methods, results, summary)
-    - The main topic or idea of this chunk
-    - How it relates to the overall document
+def _get_chunk_context_chain() -> Runnable:
+    return _build_llm_chain(chunk_context_prompt_template)
 
-    Keep it concise, helpful, and neutral in tone.
 
-    Context:
+def summarize_document(
+    document: str,
+    max_chars: int = CONTEXT_DOC_MAX_CHARS,
+    max_concurrency: int = CONTEXT_MAX_CONCURRENCY,
+) -> str:
+    """
+    Bound the `{paper}` text that is sent with every chunk-context call.
+    Documents up to `max_chars` are returned unchanged. Longer ones are cut
+    into `max_chars` windows, each window is summarized (map, one batch),
+    and the summaries are joined in document order (reduce). If the joined
+    summaries are still over `max_chars`, they are summarized again, so the
+    result never exceeds `max_chars` regardless of document length.
     """
+    if len(document) <= max_chars:
+        return document
+
+    sections = [document[i:i + max_chars] for i in range(0, len(document), max_chars)]
+    summarizer_chain = _build_llm_chain(doc_summary_prompt_template)
+    summaries = summarizer_chain.batch(
+        [{"section": section} for section in sections],
+        config={"max_concurrency": max_concurrency},
+    )
+    reduced = "\n\n".join(
+        f"[Section {i}/{len(sections)}]\n{summary.strip()}"
+        for i, summary in enumerate(summaries, start=1)
+    )
+
+    # Guard against summaries that don't shrink the text: cut to the budget
+    if len(reduced) >= len(document):
+        return reduced[:max_chars]
+    return summarize_document(reduced, max_chars, max_concurrency)
 
-    prompt_template = ChatPromptTemplate.from_template(chunk_process_prompt)
-    llm = _get_context_llm()
-    agentic_chunk_chain = prompt_template | llm | StrOutputParser()
 
+def generate_chunk_context(document: str, chunk: str) -> str:
+    """
+    Given the full paper/document + a chunk, generate a short context string
+    describing how this chunk fits into the overall doc.
+    """
+    agentic_chunk_chain = _get_chunk_context_chain()
     context = agentic_chunk_chain.invoke({"paper": document, "chunk": chunk})
     return context.strip()
 
 
+def generate_chunk_contexts(
+    document: str,
+    chunks: List[str],
+    max_concurrency: int = CONTEXT_MAX_CONCURRENCY,
+) -> List[str]:
+    """
+    Same as `generate_chunk_context`, but for many chunks of one document.
+    Runs as a single `.batch()` over one chain / client with at most
+    `max_concurrency` calls in flight; contexts keep the order of `chunks`.
+
+    The first chunk is sent on its own so the shared document prefix is
+    already in the provider's prompt cache when the rest fan out.
+    """
+    if not chunks:
+        return []
+
+    agentic_chunk_chain = _get_chunk_context_chain()
+    inputs = [{"paper": document, "chunk": chunk} for chunk in chunks]
+    contexts = [agentic_chunk_chain.invoke(inputs[0])]
+    contexts += agentic_chunk_chain.batch(
+        inputs[1:],
+        config={"max_concurrency": max_concurrency},
+    )
+    return [context.strip() for context in contexts]
+
+
 # -------------------------
 # Document loading + chunking
 # -------------------------
-def load_pdf(file_path: str | Path) -> List[Document]:
+def load_pdf(file_path: str | Path) -> Tuple[str, List[Document]]:
+    """
+    Read a PDF in a single PyMuPDF pass.
+    Returns the full document text (pages joined by blank lines) and one
+    Document per page with `source` / `page` metadata.
+    """
     file_path = str(file_path)
-    loader = PyMuPDFLoader(file_path)
-    return loader.load()
+    doc_pages: List[Document] = []
+    with fitz.open(file_path) as pdf:
+        for page in pdf:
+            doc_pages.append(
+                Document(
+                    page_content=page.get_text(),
+                    metadata={"source": file_path, "page": page.number},
+                )
+            )
+
+    original_doc_text = "\n\n".join(page.page_content for page in doc_pages)
+    return original_doc_text, doc_pages
+
+
+def _chunk_id(title: str, page: int, chunk_content: str) -> str:
+    """
+    Deterministic chunk id: the same chunk of the same file always maps to
+    the same id, so rebuilding the index can skip what is already stored.
+    """
+    key = f"{title}\x00{page}\x00{chunk_content}"
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
 
 
 def create_contextual_chunks(
     file_path: str | Path,
     chunk_size: int = CHUNK_SIZE,
     chunk_overlap: int = CHUNK_OVERLAP,
+    loaded: Tuple[str, List[Document]] | None = None,
 ) -> List[Document]:
     """
-    1. Load PDF pages
+    1. Load PDF pages (and the full text, in the same pass), unless an
+       already extracted `load_pdf(file_path)` result is passed as `loaded`
     2. Split into chunks
-    3. For each chunk, generate LLM-based context and prepend it to the text
+    3. For each chunk, generate LLM-based context (against the full text, or
+       a summary of it for long documents) and prepend it to the text
     4. Return enriched Documents with metadata (id, page, source, title)
     """
+    # Runs on the ingestion worker threads: tqdm.write keeps these lines from
+    # interleaving with each other and with the progress bar
     file_path = str(file_path)
-    print(f"Loading pages: {file_path}")
-    doc_pages = load_pdf(file_path)
-
-    print("Combining full document text for context...")
-    original_doc_text = "\n\n".join(page.page_content for page in doc_pages)
+    if loaded is None:
+        tqdm.write(f"Loading pages: {file_path}")
+        loaded = load_pdf(file_path)
+    original_doc_text, doc_pages = loaded
 
-    print("Chunking pages:", file_path)
+    tqdm.write(f"Chunking pages: {file_path}")
     splitter = RecursiveCharacterTextSplitter(
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap,
     )
     doc_chunks = splitter.split_documents(doc_pages)
 
-    contextual_chunks: List[Document] = []
-    print("Generating contextual chunks:", file_path)
+    # Long documents are condensed once, not re-sent in full with every chunk
+    paper = summarize_document(original_doc_text)
 
-    for chunk in doc_chunks:
+    tqdm.write(f"Generating contextual chunks: {file_path}")
+    contexts = generate_chunk_contexts(
+        paper,
+        [chunk.page_content for chunk in doc_chunks],
+    )
+
+    contextual_chunks: List[Document] = []
+    for chunk, context in zip(doc_chunks, contexts):
         chunk_content = chunk.page_content
         meta = chunk.metadata
 
+        page = meta.get("page", 0)
+        title = Path(meta.get("source", file_path)).name
         chunk_metadata = {
-            "id": str(uuid.uuid4()),
-            "page": meta.get("page", 0),
+            "id": _chunk_id(title, page, chunk_content),
+            "page": page,
             "source": meta.get("source", file_path),
-            "title": Path(meta.get("source", file_path)).name,
+            "title": title,
         }
-
-        context = generate_chunk_context(original_doc_text, chunk_content)
+        # Saves re-formatting the citation header on every query
+        chunk_metadata["_formatted"] = format_doc_header(chunk_metadata)
 
         contextual_chunks.append(
             Document(
@@ -131,15 +315,81 @@ def create_contextual_chunks(
             )
         )
 
-    print("Finished processing:", file_path)
+    tqdm.write(f"Finished processing: {file_path}")
     return contextual_chunks
 
 
+def _extract_pdfs(file_paths: List[str | Path]) -> List[Tuple[str, List[Document]]]:
+    """
+    Run `load_pdf` for every file, in order. Text extraction is CPU-bound and
+    PyMuPDF holds the GIL for much of it, so larger uploads are spread across
+    processes (one per core) rather than threads. Small uploads stay inline,
+    where the worker start-up cost would outweigh the extraction it saves.
+    """
+    total_bytes = sum(os.path.getsize(fp) for fp in file_paths)
+    if len(file_paths) < 2 or total_bytes < EXTRACT_PROCESS_MIN_BYTES:
+        return [load_pdf(fp) for fp in file_paths]
+
+    # "spawn", not the Linux default "fork": we are called from a
+    # multi-threaded Streamlit server, and forking after threads start can
+    # deadlock the children.
+    max_workers = min(os.cpu_count() or 1, len(file_paths))
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+    ) as executor:
+        return list(executor.map(load_pdf, file_paths))
+
+
 # -------------------------
 # Vector DB builder/loader
 # -------------------------
-def get_embedding_model() -> OpenAIEmbeddings:
-    return OpenAIEmbeddings(model=EMBEDDING_MODEL)
+def _chroma_client_settings() -> Settings:
+    # Build and load must pass identical settings: Chroma keeps one client
+    # per persist directory and rejects a second one with different settings.
+    # is_persistent must be explicit once client_settings are passed.
+    return Settings(anonymized_telemetry=False, is_persistent=True)
+
+
+def _open_collection(persist_directory: str, embedding_model: OpenAIEmbeddings) -> Chroma:
+    # Build and load share this, so whichever runs first creates the
+    # collection with the same cosine space
+    return Chroma(
+        collection_name=COLLECTION_NAME,
+        embedding_function=embedding_model,
+        collection_metadata={"hnsw:space": "cosine"},
+        persist_directory=persist_directory,
+        client_settings=_chroma_client_settings(),
+    )
+
+
+def _chroma_batch_size(vectorstore: Chroma) -> int:
+    """
+    CHROMA_BATCH_SIZE, capped at the client's own per-call limit (Chroma
+    raises instead of splitting when a single add exceeds it).
+    """
+    client = vectorstore._client
+    if hasattr(client, "get_max_batch_size"):
+        return min(CHROMA_BATCH_SIZE, client.get_max_batch_size())
+    if hasattr(client, "max_batch_size"):
+        return min(CHROMA_BATCH_SIZE, client.max_batch_size)
+    return CHROMA_BATCH_SIZE
+
+
+def get_cached_embedding_model(
+    embedding_model: OpenAIEmbeddings | None = None,
+) -> CacheBackedEmbeddings:
+    """
+    Wrap the embedding model so `embed_documents` results are cached on disk,
+    keyed by model + dimensions + text hash. Unchanged chunks are not
+    re-embedded when the index is rebuilt.
+    """
+    store = LocalFileStore(str(Path(CACHE_DIR) / "embeddings"))
+    return CacheBackedEmbeddings.from_bytes_store(
+        embedding_model or get_embedding_model(),
+        store,
+        namespace=f"{EMBEDDING_MODEL}-{EMBEDDING_DIMENSIONS}",
+    )
 
 
 def build_vectorstore_from_pdfs(
@@ -150,21 +400,62 @@ def build_vectorstore_from_pdfs(
     Given PDF file paths, create contextual chunks, embed them, and
     persist them into a Chroma DB.
     """
+    # Stage 1 (CPU-bound): extract every PDF's text across processes
+    print(f"Extracting text from {len(file_paths)} PDF(s)...")
+    extracted = _extract_pdfs(file_paths)
+
+    # Stage 2 (I/O-bound on OpenAI calls): contextualize the PDFs side by side
+    results: Dict[int, List[Document]] = {}
+    max_workers = max(1, min(INGEST_MAX_WORKERS, len(file_paths)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(create_contextual_chunks, fp, loaded=extracted[i]): i
+            for i, fp in enumerate(file_paths)
+        }
+        for future in tqdm(as_completed(futures), total=len(futures), desc="PDFs"):
+            results[futures[future]] = future.result()
+
+    # Keep documents in upload order regardless of completion order
     all_docs: List[Document] = []
-    for fp in file_paths:
-        contextual_docs = create_contextual_chunks(fp)
-        all_docs.extend(contextual_docs)
+    for i in range(len(file_paths)):
+        all_docs.extend(results[i])
 
     embedding_model = get_embedding_model()
 
     print("Building Chroma DB...")
-    vectorstore = Chroma.from_documents(
-        documents=all_docs,
-        collection_name="my_context_db",
-        embedding=embedding_model,
-        collection_metadata={"hnsw:space": "cosine"},
-        persist_directory=persist_directory,
-    )
+    vectorstore = _open_collection(persist_directory, embedding_model)
+
+    batch_size = _chroma_batch_size(vectorstore)
+
+    # Ids are content hashes: drop repeats and chunks already in the index,
+    # so a rebuild only embeds + inserts what's new
+    unique_docs = {doc.metadata["id"]: doc for doc in all_docs}
+    candidate_ids = list(unique_docs)
+    existing_ids = set()
+    for start in range(0, len(candidate_ids), batch_size):
+        batch_ids = candidate_ids[start:start + batch_size]
+        existing_ids.update(vectorstore.get(ids=batch_ids, include=[])["ids"])
+    new_docs = [doc for doc_id, doc in unique_docs.items() if doc_id not in existing_ids]
+    print(f"{len(existing_ids)} chunks already indexed, adding {len(new_docs)}")
+
+    texts = [doc.page_content for doc in new_docs]
+    metadatas = [doc.metadata for doc in new_docs]
+    ids = [m["id"] for m in metadatas]
+
+    # One embeddings request per EMBEDDING_BATCH_SIZE uncached chunks
+    print(f"Embedding {len(texts)} chunks...")
+    embeddings = get_cached_embedding_model(embedding_model).embed_documents(texts)
+
+    # Fixed-size inserts; Chroma >= 0.4 writes through to disk on each add,
+    # so there is no separate persist() step to defer to the end
+    for start in range(0, len(ids), batch_size):
+        end = start + batch_size
+        vectorstore._collection.add(
+            ids=ids[start:end],
+            embeddings=embeddings[start:end],
+            documents=texts[start:end],
+            metadatas=metadatas[start:end],
+        )
 
     print("Chroma DB created & persisted to:", persist_directory)
     return vectorstore
@@ -175,11 +466,23 @@ def load_vectorstore(
 ) -> Chroma:
     """
     Load an existing Chroma DB from disk.
+    Opening a collection that doesn't exist yet creates it empty, so callers
+    should check `vectorstore._collection.count()` before relying on it.
     """
     embedding_model = get_embedding_model()
-    vectorstore = Chroma(
-        persist_directory=persist_directory,
-        collection_name="my_context_db",
-        embedding_function=embedding_model,
-    )
-    return vectorstore
+    return _open_collection(persist_directory, embedding_model)
+
+
+def warm_up_vectorstore(vectorstore: Chroma, hnsw: bool = True) -> None:
+    """
+    Open the embedding client's connection before the first real question.
+    With hnsw=True, run a throwaway similarity search so Chroma also loads its
+    HNSW index; skip that when the flat retriever will serve queries.
+    """
+    try:
+        if hnsw:
+            vectorstore.similarity_search("warmup", k=1)
+        else:
+            vectorstore.embeddings.embed_query("warmup")
+    except Exception as e:  # best effort: a bad key shouldn't break startup
+        print("Vector store warm-up failed:", e)
@@ -1,11 +1,24 @@
 # retriever.py
 from __future__ import annotations
 
+from typing import List
+
+import numpy as np
+from pydantic import ConfigDict
+
 from langchain_chroma import Chroma
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
 from langchain_core.vectorstores import VectorStoreRetriever
 
 from config import RETRIEVER_K
 
+try:
+    import simsimd
+except ImportError:  # fall back to a NumPy scan
+    simsimd = None
+
 
 def get_similarity_retriever(
     vectorstore: Chroma,
@@ -19,3 +32,83 @@ def get_similarity_retriever(
         search_kwargs={"k": k},
     )
     return retriever
+
+
+# -------------------------
+# Flat (brute-force) retriever for small collections
+# -------------------------
+def _cosine_distances(query: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+    if simsimd is not None:
+        return np.asarray(simsimd.cdist(query[None], vectors, metric="cosine"))[0]
+
+    norms = np.linalg.norm(vectors, axis=1) * np.linalg.norm(query)
+    return 1.0 - (vectors @ query) / np.maximum(norms, 1e-12)
+
+
+class FlatSimilarityRetriever(BaseRetriever):
+    """
+    Exact top-k cosine search over every vector of a Chroma collection,
+    held in memory as one contiguous float32 matrix (SimSIMD when installed,
+    NumPy otherwise). Skips HNSW traversal and Chroma's per-query overhead,
+    which wins for collections up to a few hundred thousand chunks.
+    Only ids sit next to the matrix; the top-k documents are fetched from
+    Chroma per query, so the corpus text is never copied into memory.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    vectorstore: Chroma
+    ids: List[str]
+    vectors: np.ndarray
+    k: int = RETRIEVER_K
+
+    @classmethod
+    def from_vectorstore(
+        cls,
+        vectorstore: Chroma,
+        k: int = RETRIEVER_K,
+    ) -> FlatSimilarityRetriever:
+        data = vectorstore.get(include=["embeddings"])
+        vectors = np.asarray(data["embeddings"], dtype=np.float32, order="C")
+        return cls(
+            vectorstore=vectorstore,
+            ids=list(data["ids"]),
+            vectors=vectors,
+            k=k,
+        )
+
+    def _get_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: CallbackManagerForRetrieverRun,
+    ) -> List[Document]:
+        if not self.ids:
+            return []
+
+        embeddings = self.vectorstore.embeddings
+        query_vector = np.asarray(embeddings.embed_query(query), dtype=np.float32)
+        distances = _cosine_distances(query_vector, self.vectors)
+
+        k = min(self.k, len(self.ids))
+        top = np.argpartition(distances, k - 1)[:k]
+        top = top[np.argsort(distances[top])]
+        top_ids = [self.ids[i] for i in top]
+
+        # Chroma returns rows in its own order; put them back in rank order
+        data = self.vectorstore.get(ids=top_ids, include=["documents", "metadatas"])
+        docs_by_id = {
+            doc_id: Document(page_content=text, metadata=meta or {})
+            for doc_id, text, meta in zip(data["ids"], data["documents"], data["metadatas"])
+        }
+        return [docs_by_id[doc_id] for doc_id in top_ids if doc_id in docs_by_id]
+
+
+def get_flat_similarity_retriever(
+    vectorstore: Chroma,
+    k: int = RETRIEVER_K,
+) -> FlatSimilarityRetriever:
+    """
+    Load all vectors from a Chroma store into a flat in-memory retriever.
+    """
+    return FlatSimilarityRetriever.from_vectorstore(vectorstore, k=k)